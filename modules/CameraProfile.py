@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+import numpy as np
+
+# Registry shipped with the repository, next to the coefficient files it references
+DEFAULT_REGISTRY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "camera_profiles.json")
+
+# Process-wide caches: parsed registries by path, memory-mapped coefficients by file
+_registry_cache = {}
+_coeffs_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CameraProfile:
+    def __init__(self, name, coeffs_path, reference_exposure, polynomial_order):
+        """
+        Initialize a camera calibration profile.
+
+        Parameters:
+        - name (str): Registry key, "<make> <model>" as reported by EXIF.
+        - coeffs_path (str): Path of the .npy polynomial coefficients (N x 3).
+        - reference_exposure (dict): Exposure the coefficients were fitted at,
+                                     e.g. {"aperture": 8, "shutter_speed": 0.25, "iso": 100}.
+        - polynomial_order (int): Number of polynomial terms (3, 5, 9, 11, 18 or 20).
+        """
+        self.name = name
+        self.coeffs_path = coeffs_path
+        self.reference_exposure = reference_exposure
+        self.polynomial_order = polynomial_order
+
+    @property
+    def polynomial_coeffs(self):
+        """
+        Polynomial coefficients (N x 3), memory-mapped on first use and shared by every profile
+        and pipeline in the process that refers to the same file.
+        """
+        with _cache_lock:
+            coeffs = _coeffs_cache.get(self.coeffs_path)
+            if coeffs is None:
+                coeffs = np.load(self.coeffs_path, mmap_mode='r')
+                _coeffs_cache[self.coeffs_path] = coeffs
+        # Checked per profile, since profiles sharing a file may declare different orders
+        if coeffs.shape[0] != self.polynomial_order:
+            raise ValueError(f"{self.coeffs_path} has {coeffs.shape[0]} terms, profile {self.name} expects {self.polynomial_order}")
+        return coeffs
+
+    def exposure_factor(self, shutter_speed, aperture, iso):
+        """
+        Scale from the exposure of a frame to the calibration reference exposure.
+        """
+        ref = self.reference_exposure
+        return (ref["shutter_speed"] / shutter_speed) * (aperture / ref["aperture"])**2 * (ref["iso"] / iso)
+
+
+def load_registry(registry_path=None):
+    """
+    Parse a profile registry (JSON) once per process.
+
+    The registry maps "<make> <model>" to {"coeffs", "reference_exposure", "polynomial_order"};
+    relative coefficient paths are resolved against the registry's directory.
+
+    Returns:
+    - profiles (dict): CameraProfile per registry key.
+    """
+    registry_path = os.path.abspath(registry_path or DEFAULT_REGISTRY_PATH)
+    with _cache_lock:
+        profiles = _registry_cache.get(registry_path)
+        if profiles is not None:
+            return profiles
+
+    with open(registry_path) as f:
+        entries = json.load(f)
+    base_dir = os.path.dirname(registry_path)
+    profiles = {
+        name: CameraProfile(
+            name,
+            os.path.join(base_dir, entry["coeffs"]),
+            entry["reference_exposure"],
+            entry.get("polynomial_order", 9),
+        )
+        for name, entry in entries.items()
+    }
+
+    with _cache_lock:
+        return _registry_cache.setdefault(registry_path, profiles)
+
+
+def get_camera_profile(make, model, registry_path=None):
+    """
+    Look up the calibration profile of a camera body.
+
+    Parameters:
+    - make (str): Camera make, e.g. EXIF "Image Make".
+    - model (str): Camera model, e.g. EXIF "Image Model".
+    - registry_path (str): Registry JSON. Default is DEFAULT_REGISTRY_PATH.
+
+    Returns:
+    - profile (CameraProfile): Matching profile, or None if the body is not registered.
+    """
+    name = f"{str(make).strip()} {str(model).strip()}".strip()
+    return load_registry(registry_path).get(name)
@@ -0,0 +1,367 @@
+import numpy as np
+from modules.RawBlc import RawBlc
+from modules.RawToRgb import RawToRgb
+from modules.RgbToXyz import RgbToXyz
+from modules.XyzToRgb import XyzToRgb
+from modules.RgbToImg import RgbToImg, PQ_PEAK_LUMINANCE
+from modules.CameraProfile import get_camera_profile
+
+# Stage outputs in pipeline order, named after the ImagePipeline attributes
+STAGES = ["blc_data", "rgb_data", "xyz_data", "rgb_data_final", "code_values"]
+
+# Default pass/fail limits per stage. Absolute errors are in the stage's own units: blc_data relative
+# to the RAW full scale, camera RGB in [0, 1], XYZ and output RGB with 1.0 = 10000 cd/m2 for the
+# polynomial (HDR) path, code_values in quantized steps.
+DEFAULT_TOLERANCES = {
+    "blc_data": {"max_abs": 1e-4, "mean_abs": 1e-5},
+    "rgb_data": {"max_abs": 1e-4, "mean_abs": 1e-5},
+    "xyz_data": {"max_abs": 1e-5, "mean_abs": 1e-6},
+    "rgb_data_final": {"max_abs": 1e-5, "mean_abs": 1e-6, "delta_e_max": 0.5, "delta_e_mean": 0.05},
+    "code_values": {"max_abs": 1, "mismatch": 1.0},  # mismatch: fraction allowed to differ at all; 1.0 disables it
+}
+
+# Diffuse (graphics) white of HDR output in cd/m2, ITU-R BT.2408. CIELAB of HDR output is taken
+# relative to it, so that typical content lands around L* 50-100 instead of below 10.
+HDR_REFERENCE_WHITE = 203
+
+
+def synthetic_fixture(height=256, width=384, bayer_pattern=None, bit_depth=14, black_level=512, seed=0):
+    """
+    Generate a synthetic Bayer frame with smooth gradients, colour patches and sensor noise.
+
+    Parameters:
+    - height, width (int): Frame size, rounded down to a multiple of 2.
+    - bayer_pattern (np.ndarray): Bayer Pattern layout. Default is RGGB.
+    - bit_depth (int): Bit depth of the simulated sensor.
+    - black_level (int): Black level offset for all CFA channels.
+    - seed (int): Seed of the noise generator.
+
+    Returns:
+    - fixture (dict): RAW data and the metadata the reference pipeline needs.
+    """
+    if bayer_pattern is None:
+        bayer_pattern = np.array([[0, 1], [3, 2]])
+    height, width = height - height % 2, width - width % 2
+    white_level = 2 ** bit_depth - 1
+    rng = np.random.default_rng(seed)
+
+    # Per-channel scene: horizontal/vertical ramps plus a grid of flat patches
+    y, x = np.mgrid[0:height // 2, 0:width // 2].astype(np.float64)
+    ramp_x = x / max(width // 2 - 1, 1)
+    ramp_y = y / max(height // 2 - 1, 1)
+    patches = rng.uniform(0.05, 0.9, size=(3, 4, 6))
+    patch_idx_y = np.minimum((ramp_y * 4).astype(int), 3)
+    patch_idx_x = np.minimum((ramp_x * 6).astype(int), 5)
+    scene = np.stack([
+        0.5 * patches[0][patch_idx_y, patch_idx_x] + 0.5 * ramp_x,
+        0.5 * patches[1][patch_idx_y, patch_idx_x] + 0.5 * ramp_y,
+        0.5 * patches[2][patch_idx_y, patch_idx_x] + 0.5 * (1 - ramp_x),
+    ])
+
+    # Mosaic the scene; both green sites sample channel 1
+    channel_of = {0: 0, 1: 1, 2: 2, 3: 1}
+    signal = np.zeros((height, width))
+    for dy in range(2):
+        for dx in range(2):
+            signal[dy::2, dx::2] = scene[channel_of[int(bayer_pattern[dy][dx])]]
+
+    # Shot + read noise, then offset by the black level
+    electrons = signal * (white_level - black_level)
+    noisy = electrons + rng.normal(0, 1, signal.shape) * np.sqrt(electrons + 4.0)
+    raw_data = np.clip(np.round(noisy) + black_level, black_level, white_level).astype(np.uint16)
+
+    return {
+        "raw_data": raw_data,
+        "bayer_pattern": np.asarray(bayer_pattern),
+        "bit_depth": bit_depth,
+        "blc_params": {"R": black_level, "G1": black_level, "G2": black_level, "B": black_level},
+        "expo_factor": 1.0,
+    }
+
+
+def load_fixture(path, expo_factor=1.0):
+    """
+    Load a fixture from a RAW file (read with rawpy) or from an .npz saved from a previous run.
+
+    Parameters:
+    - path (str): Path to a RAW/DNG file or an .npz with raw_data, bayer_pattern, bit_depth and black_level.
+    - expo_factor (float): Exposure factor passed to the polynomial transform.
+
+    Returns:
+    - fixture (dict): RAW data and the metadata the reference pipeline needs.
+    """
+    if path.endswith(".npz"):
+        data = np.load(path)
+        black_level = [int(v) for v in np.broadcast_to(data["black_level"], (4,))]
+        return {
+            "raw_data": data["raw_data"],
+            "bayer_pattern": data["bayer_pattern"],
+            "bit_depth": float(data["bit_depth"]),
+            "blc_params": dict(zip(["R", "G1", "G2", "B"], black_level)),
+            "expo_factor": expo_factor,
+        }
+
+    import rawpy
+    import math
+    raw = rawpy.imread(path)
+    return {
+        "raw_data": raw.raw_image.copy(),
+        "bayer_pattern": raw.raw_pattern,
+        "bit_depth": math.log(raw.white_level + 1, 2),
+        "blc_params": {
+            "R": raw.black_level_per_channel[0],
+            "G1": raw.black_level_per_channel[1],
+            "G2": raw.black_level_per_channel[2],
+            "B": raw.black_level_per_channel[3]
+        },
+        "expo_factor": expo_factor,
+    }
+
+
+def rgb_to_lab(rgb_data, rgb_to_xyz_matrix, white_level=1.0):
+    """
+    Convert linear RGB to CIELAB, using RGB (white_level, white_level, white_level) as reference white.
+
+    Parameters:
+    - rgb_data (np.ndarray): Linear RGB image (... x 3).
+    - rgb_to_xyz_matrix (np.ndarray): RGB to XYZ matrix (3x3) of the output colour space.
+    - white_level (float): Linear RGB value of the reference white. Values above it give L* > 100.
+
+    Returns:
+    - lab_data (np.ndarray): CIELAB image (... x 3).
+    """
+    xyz = np.dot(rgb_data, rgb_to_xyz_matrix.T)
+    white = rgb_to_xyz_matrix.sum(axis=1) * white_level
+    t = xyz / white
+
+    epsilon, kappa = 216 / 24389, 24389 / 27
+    f = np.where(t > epsilon, np.cbrt(np.maximum(t, epsilon)), (kappa * t + 16) / 116)
+
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def delta_e_2000(lab1, lab2):
+    """
+    CIEDE2000 colour difference between two CIELAB images.
+
+    Parameters:
+    - lab1, lab2 (np.ndarray): CIELAB images (... x 3).
+
+    Returns:
+    - delta_e (np.ndarray): Per-pixel ΔE2000 (...).
+    """
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    C_bar = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    G = 0.5 * (1 - np.sqrt(C_bar**7 / (C_bar**7 + 25.0**7)))
+    a1p, a2p = (1 + G) * a1, (1 + G) * a2
+    C1p, C2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, dhp)
+    dhp = np.where(dhp < -180, dhp + 360, dhp)
+    dhp = np.where(C1p * C2p == 0, 0, dhp)
+    dHp = 2 * np.sqrt(C1p * C2p) * np.sin(np.radians(dhp) / 2)
+
+    Lp_bar = (L1 + L2) / 2
+    Cp_bar = (C1p + C2p) / 2
+    hp_sum = h1p + h2p
+    hp_bar = np.where(np.abs(h1p - h2p) > 180, (hp_sum + 360) / 2, hp_sum / 2)
+    hp_bar = np.where(hp_bar >= 360, hp_bar - 360, hp_bar)
+    hp_bar = np.where(C1p * C2p == 0, hp_sum, hp_bar)
+
+    T = (1 - 0.17 * np.cos(np.radians(hp_bar - 30)) + 0.24 * np.cos(np.radians(2 * hp_bar))
+         + 0.32 * np.cos(np.radians(3 * hp_bar + 6)) - 0.20 * np.cos(np.radians(4 * hp_bar - 63)))
+    d_theta = 30 * np.exp(-(((hp_bar - 275) / 25) ** 2))
+    R_C = 2 * np.sqrt(Cp_bar**7 / (Cp_bar**7 + 25.0**7))
+    S_L = 1 + 0.015 * (Lp_bar - 50) ** 2 / np.sqrt(20 + (Lp_bar - 50) ** 2)
+    S_C = 1 + 0.045 * Cp_bar
+    S_H = 1 + 0.015 * Cp_bar * T
+    R_T = -np.sin(np.radians(2 * d_theta)) * R_C
+
+    return np.sqrt((dLp / S_L) ** 2 + (dCp / S_C) ** 2 + (dHp / S_H) ** 2
+                   + R_T * (dCp / S_C) * (dHp / S_H))
+
+
+class PipelineEquivalence:
+    def __init__(self, params, tolerances=None):
+        """
+        Initialize the equivalence harness.
+
+        Parameters:
+        - params (dict): Pipeline parameters, using the same keys as ImagePipeline
+                         ("demosaic", "rgb_to_xyz_method", "ccm", "polynomial_coeffs", "polynomial_order", "xyz_to_rgb_method",
+                         "color_space", "output_mode", "gamma", "hdr_format").
+        - tolerances (dict): Per-stage overrides for DEFAULT_TOLERANCES, e.g. {"xyz_data": {"max_abs": 1e-4}}.
+        """
+        self.params = params
+        self.tolerances = {stage: dict(limits) for stage, limits in DEFAULT_TOLERANCES.items()}
+        for stage, limits in (tolerances or {}).items():
+            if stage not in self.tolerances:
+                raise ValueError(f"Unknown stage: {stage}")
+            self.tolerances[stage].update(limits)
+
+    def reference(self, fixture):
+        """
+        Run the reference RawBlc -> RawToRgb -> RgbToXyz -> XyzToRgb -> RgbToImg chain.
+
+        Parameters:
+        - fixture (dict): Fixture as returned by synthetic_fixture or load_fixture.
+
+        Returns:
+        - outputs (dict): Output of every stage, keyed as in STAGES.
+        """
+        outputs = {}
+        raw_blc = RawBlc(fixture["bayer_pattern"], fixture["blc_params"])
+        outputs["blc_data"] = raw_blc.process(fixture["raw_data"])
+
+        raw_to_rgb = RawToRgb(outputs["blc_data"], fixture["bayer_pattern"], demosaic=self.params["demosaic"], bit_depth=fixture["bit_depth"])
+        outputs["rgb_data"] = raw_to_rgb.process()
+
+        rgb_to_xyz = RgbToXyz(method=self.params["rgb_to_xyz_method"], ccm=self.params.get("ccm"), polynomial_coeffs=self.params.get("polynomial_coeffs"), bit_depth=fixture["bit_depth"], expo_factor=fixture["expo_factor"], polynomial_order=self.params.get("polynomial_order", 9))
+        outputs["xyz_data"] = rgb_to_xyz.process(outputs["rgb_data"])
+
+        outputs["rgb_data_final"] = self._xyz_to_rgb().process(outputs["xyz_data"])
+        outputs["code_values"] = self._rgb_to_img().encode(outputs["rgb_data_final"])
+        return outputs
+
+    def compare(self, fixture, candidate):
+        """
+        Run the reference and a candidate on the same fixture and measure how far they diverge.
+
+        Parameters:
+        - fixture (dict): Fixture as returned by synthetic_fixture or load_fixture.
+        - candidate (callable): candidate(fixture) -> dict with any subset of the STAGES keys.
+                                If "rgb_data_final" is returned without "code_values", the
+                                reference RgbToImg quantization is applied to it.
+
+        Returns:
+        - report (dict): Per-stage metrics with a "passed" flag, plus an overall "passed".
+        """
+        reference = self.reference(fixture)
+        outputs = dict(candidate(fixture))
+        if "rgb_data_final" in outputs and "code_values" not in outputs:
+            outputs["code_values"] = self._rgb_to_img().encode(outputs["rgb_data_final"])
+
+        report = {}
+        for stage in STAGES:
+            if stage not in outputs:
+                continue
+            ref, out = reference[stage], outputs[stage]
+            if ref.shape != out.shape:
+                raise ValueError(f"Shape mismatch in {stage}: reference {ref.shape}, candidate {out.shape}")
+
+            tolerances = self.tolerances[stage]
+            if stage == "code_values":
+                report[stage] = self._code_value_metrics(ref, out, tolerances)
+                continue
+
+            ref, out = ref.astype(np.float64), out.astype(np.float64)
+            if stage == "blc_data":
+                full_scale = 2 ** fixture["bit_depth"] - 1
+                ref, out = ref / full_scale, out / full_scale
+            metrics = self._abs_metrics(ref, out, tolerances)
+            if stage == "rgb_data_final":
+                delta_e = self._delta_e_metrics(ref, out, tolerances)
+                delta_e["passed"] = delta_e["passed"] and metrics["passed"]
+                metrics.update(delta_e)
+            report[stage] = metrics
+
+        report["passed"] = all(m["passed"] for m in report.values())
+        return report
+
+    def _abs_metrics(self, ref, out, tolerances):
+        abs_err = np.abs(out - ref)
+        metrics = {"max_abs": float(abs_err.max()), "mean_abs": float(abs_err.mean())}
+        metrics["passed"] = (metrics["max_abs"] <= tolerances["max_abs"]
+                             and metrics["mean_abs"] <= tolerances["mean_abs"])
+        return metrics
+
+    def _delta_e_metrics(self, ref, out, tolerances):
+        rgb_to_xyz_matrix = np.linalg.inv(self._xyz_to_rgb_matrix())
+        # HDR output is linear with 1.0 = 10000 cd/m2; compare it relative to diffuse white
+        white_level = HDR_REFERENCE_WHITE / PQ_PEAK_LUMINANCE if self.params["output_mode"] == "HDR" else 1.0
+        delta_e = delta_e_2000(rgb_to_lab(ref, rgb_to_xyz_matrix, white_level), rgb_to_lab(out, rgb_to_xyz_matrix, white_level))
+        metrics = {"delta_e_max": float(delta_e.max()), "delta_e_mean": float(delta_e.mean())}
+        metrics["passed"] = (metrics["delta_e_max"] <= tolerances["delta_e_max"]
+                             and metrics["delta_e_mean"] <= tolerances["delta_e_mean"])
+        return metrics
+
+    def _code_value_metrics(self, ref, out, tolerances):
+        diff = np.abs(out.astype(np.int64) - ref.astype(np.int64))
+        metrics = {
+            "max_abs": int(diff.max()),
+            "mean_abs": float(diff.mean()),
+            "mismatch": float(np.count_nonzero(diff) / diff.size),
+        }
+        metrics["passed"] = (metrics["max_abs"] <= tolerances["max_abs"]
+                             and metrics["mismatch"] <= tolerances["mismatch"])
+        return metrics
+
+    def _xyz_to_rgb(self):
+        return XyzToRgb(method=self.params["xyz_to_rgb_method"], display_matrix=self.params.get("display_matrix"), color_space=self.params["color_space"])
+
+    def _xyz_to_rgb_matrix(self):
+        xyz_to_rgb = self._xyz_to_rgb()
+        if xyz_to_rgb.method == "custom":
+            return xyz_to_rgb.display_matrix
+        return xyz_to_rgb.color_space_matrices[xyz_to_rgb.color_space]
+
+    def _rgb_to_img(self):
+        return RgbToImg(mode=self.params["output_mode"], gamma=self.params["gamma"], color_space=self.params["color_space"], hdr_format=self.params["hdr_format"])
+
+
+def format_report(report):
+    """
+    Format a report from PipelineEquivalence.compare as a human-readable table.
+    """
+    lines = []
+    for stage in STAGES:
+        if stage not in report:
+            continue
+        metrics = report[stage]
+        values = ", ".join(f"{k}={v:.3g}" for k, v in metrics.items() if k != "passed")
+        lines.append(f"{stage:<15} {'PASS' if metrics['passed'] else 'FAIL'}  {values}")
+    lines.append(f"{'overall':<15} {'PASS' if report['passed'] else 'FAIL'}")
+    return "\n".join(lines)
+
+
+def main():
+    """
+    Main function to demonstrate the harness: compare the reference chain against itself
+    with every intermediate rounded to float32.
+    """
+    # Coefficients come from the repository's profile registry, independent of the working directory
+    profile = get_camera_profile("SONY", "ILCE-7CM2")
+    params = {
+        "demosaic": True,
+        "rgb_to_xyz_method": "polynomial",
+        "ccm": None,
+        "polynomial_coeffs": profile.polynomial_coeffs.T,
+        "polynomial_order": profile.polynomial_order,
+        "xyz_to_rgb_method": "default",
+        "color_space": "Display P3",
+        "output_mode": "HDR",
+        "gamma": 2.2,
+        "hdr_format": "AVIF",
+    }
+    harness = PipelineEquivalence(params)
+
+    def float32_candidate(fixture):
+        outputs = harness.reference(fixture)
+        return {stage: outputs[stage].astype(np.float32) for stage in ["rgb_data", "xyz_data", "rgb_data_final"]}
+
+    fixture = synthetic_fixture()
+    print(format_report(harness.compare(fixture, float32_candidate)))
+
+if __name__ == "__main__":
+    main()
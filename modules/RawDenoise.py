@@ -0,0 +1,189 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Noise model at ISO 100 in DN of the RAW data: variance = shot * signal + read.
+# Shot noise scales with the analogue gain, read noise with its square.
+DEFAULT_NOISE_PROFILE = {"shot": 1.0, "read": 4.0, "base_iso": 100}
+
+# Window of the bilateral filter per mode, from most to least expensive:
+# (radius in CFA plane pixels, cross-shaped window)
+MODE_WINDOW = {"quality": (2, False), "fast": (1, False), "minimal": (1, True)}
+MODE_RADIUS = {mode: radius for mode, (radius, _) in MODE_WINDOW.items()}
+
+# Edge of the sample tile timed to pick a mode for a time budget, in CFA plane pixels
+BUDGET_SAMPLE_SIZE = 128
+
+
+class RawDenoise:
+    def __init__(self, iso=100, noise_profile=None, strength=1.0, mode="quality", tile_size=256, workers=None, time_budget=None):
+        """
+        Initialize the RawDenoise module.
+
+        Parameters:
+        - iso (float): ISO of the frame (e.g. EXIF ISOSpeedRatings), used to scale the noise profile.
+        - noise_profile (dict): {"shot", "read", "base_iso"} noise model. Default is DEFAULT_NOISE_PROFILE.
+        - strength (float): Multiplier of the range sigma. 0 disables the filter.
+        - mode (str): "quality" (5x5 bilateral), "fast" (3x3 bilateral) or "minimal" (5-tap cross).
+        - tile_size (int): Tile edge in CFA plane pixels; each tile is filtered with a halo of the window radius.
+        - workers (int): Number of worker threads. Default is os.cpu_count().
+        - time_budget (float): Budget in milliseconds per megapixel. Before filtering, each mode from `mode`
+                               down to "minimal" is timed on a sample tile and the first one that fits is used
+                               for the whole frame; "minimal" is used if none fits. The choice is in applied_mode,
+                               its estimated ms per megapixel in estimated_cost and whether it fits in budget_met.
+        """
+        if mode not in MODE_WINDOW:
+            raise ValueError(f"Unsupported mode: {mode}")
+        self.iso = iso
+        self.noise_profile = noise_profile if noise_profile is not None else DEFAULT_NOISE_PROFILE
+        self.strength = strength
+        self.mode = mode
+        self.tile_size = tile_size
+        self.workers = workers or os.cpu_count() or 1
+        self.time_budget = time_budget
+        self.applied_mode = mode
+        self.estimated_cost = None  # Estimated ms per megapixel of applied_mode, when a time budget is set
+        self.budget_met = None  # Whether applied_mode fits the time budget; None without a budget
+
+        gain = iso / self.noise_profile["base_iso"]
+        self.shot_variance = self.noise_profile["shot"] * gain
+        self.read_variance = self.noise_profile["read"] * gain ** 2
+
+    def process(self, raw_data):
+        """
+        Denoise the RAW data on its four CFA planes.
+
+        Parameters:
+        - raw_data (np.ndarray): Black Level Corrected RAW image data (M x N).
+
+        Returns:
+        - denoised_data (np.ndarray): Denoised RAW image data (M x N), float32.
+        """
+        denoised_data = raw_data.astype(np.float32)
+        if self.strength <= 0:
+            return denoised_data
+
+        # The window is chosen once for the whole frame, so every tile is filtered the same way
+        self.applied_mode = self._select_mode(denoised_data) if self.time_budget is not None else self.mode
+        r, cross = MODE_WINDOW[self.applied_mode]
+
+        # Same-colour neighbours are two pixels apart, so the filter runs per CFA plane.
+        # Padding once per plane lets every tile read its halo without bounds checks.
+        planes = []
+        for dy in range(2):
+            for dx in range(2):
+                plane = denoised_data[dy::2, dx::2]
+                planes.append((np.pad(plane, r, mode='reflect'), plane))
+
+        tasks = []
+        for padded, plane in planes:
+            height, width = plane.shape
+            for top in range(0, height, self.tile_size):
+                for left in range(0, width, self.tile_size):
+                    tasks.append((padded, plane, top, left, min(self.tile_size, height - top), min(self.tile_size, width - left)))
+
+        def run(task):
+            padded, plane, top, left, tile_height, tile_width = task
+            # Tiles only write their core and read their halo from the untouched padded copy,
+            # so the stitched result is identical to filtering the whole plane at once
+            tile = padded[top:top + tile_height + 2 * r, left:left + tile_width + 2 * r]
+            plane[top:top + tile_height, left:left + tile_width] = self._bilateral(tile, r, cross)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(run, tasks))
+
+        return denoised_data
+
+    def _select_mode(self, raw_data):
+        """
+        Time each mode from self.mode downwards on a sample of the frame and return the first whose
+        estimated cost fits self.time_budget (ms per megapixel), or "minimal" if none does. The estimate
+        and whether it fits are stored in estimated_cost and budget_met.
+        """
+        modes = list(MODE_WINDOW)
+        plane = raw_data[0::2, 0::2]
+        sample = plane[:BUDGET_SAMPLE_SIZE, :BUDGET_SAMPLE_SIZE]
+        parallelism = max(min(self.workers, os.cpu_count() or 1), 1)
+
+        for mode in modes[modes.index(self.mode):]:
+            r, cross = MODE_WINDOW[mode]
+            tile = np.pad(sample, r, mode='reflect')
+            start = time.perf_counter()
+            self._bilateral(tile, r, cross)
+            self.estimated_cost = (time.perf_counter() - start) * 1000 / sample.size * 1e6 / parallelism
+            self.budget_met = self.estimated_cost <= self.time_budget
+            if self.budget_met:
+                return mode
+        # Even the cheapest mode is over budget; it is still applied to the whole frame, and budget_met says so
+        return modes[-1]
+
+    def _bilateral(self, tile, r, cross=False):
+        """
+        Bilateral filter of one padded tile with a signal-dependent range sigma from the noise profile.
+
+        Parameters:
+        - tile (np.ndarray): Tile of one CFA plane including a halo of r pixels on each side.
+        - r (int): Window radius.
+        - cross (bool): Use only the horizontal and vertical neighbours of the window.
+
+        Returns:
+        - filtered (np.ndarray): Filtered tile core (tile shape minus the halo), float32.
+        """
+        height, width = tile.shape[0] - 2 * r, tile.shape[1] - 2 * r
+        center = tile[r:r + height, r:r + width]
+
+        # Range weights use -d^2 / (2 * (strength * sigma)^2), folded into a single factor per pixel
+        variance = self.shot_variance * np.maximum(center, 0) + self.read_variance
+        inv_two_var = (-0.5 / (self.strength ** 2)) / variance
+        spatial_sigma2 = 2 * (r / 1.5) ** 2
+
+        weighted_sum = np.zeros((height, width), dtype=np.float32)
+        weight_total = np.zeros((height, width), dtype=np.float32)
+        for dy in range(-r, r + 1):
+            for dx in range(-r, r + 1):
+                if cross and dy != 0 and dx != 0:
+                    continue
+                neighbour = tile[r + dy:r + dy + height, r + dx:r + dx + width]
+                diff = neighbour - center
+                weight = np.exp(diff * diff * inv_two_var - (dy * dy + dx * dx) / spatial_sigma2)
+                weighted_sum += weight * neighbour
+                weight_total += weight
+
+        return weighted_sum / weight_total
+
+
+def main():
+    """
+    Benchmark RawDenoise against frame size and thread count on synthetic Bayer data.
+    """
+    rng = np.random.default_rng(0)
+    sizes = [(2000, 3000), (4000, 6000), (5304, 7952)]
+    threads = [1, 2, 4, os.cpu_count() or 1]
+
+    print(f"{'mode':<8} {'frame':>11} {'MP':>5} {'threads':>7} {'seconds':>8} {'ms/MP':>7}")
+    for mode in MODE_WINDOW:
+        for height, width in sizes:
+            raw_data = rng.normal(2000, 60, size=(height, width)).astype(np.float32)
+            for workers in sorted(set(threads)):
+                denoise = RawDenoise(iso=3200, mode=mode, workers=workers)
+                start = time.perf_counter()
+                denoise.process(raw_data)
+                elapsed = time.perf_counter() - start
+                megapixels = height * width / 1e6
+                print(f"{mode:<8} {width:>5}x{height:<5} {megapixels:>5.1f} {workers:>7} {elapsed:>8.2f} {elapsed * 1000 / megapixels:>7.0f}")
+
+    # Mode picked for a time budget, with the estimate it was picked on and the cost actually measured
+    height, width = sizes[0]
+    raw_data = rng.normal(2000, 60, size=(height, width)).astype(np.float32)
+    megapixels = height * width / 1e6
+    print(f"\n{'budget':>7} {'mode':<8} {'estimate':>8} {'ms/MP':>7} {'met':>5}")
+    for time_budget in [1, 50, 200, 1000]:
+        denoise = RawDenoise(iso=3200, time_budget=time_budget)
+        start = time.perf_counter()
+        denoise.process(raw_data)
+        elapsed = time.perf_counter() - start
+        print(f"{time_budget:>7} {denoise.applied_mode:<8} {denoise.estimated_cost:>8.0f} {elapsed * 1000 / megapixels:>7.0f} {str(denoise.budget_met):>5}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import numpy as np
+
+class RawDpc:
+    def __init__(self, defect_map=None, dynamic=True, threshold=0.05, bit_depth=12):
+        """
+        Initialize the RawDpc (defective pixel correction) module.
+
+        Parameters:
+        - defect_map (np.ndarray): Static defects of the sensor, either a boolean mask of the full RAW frame
+                                   (H x W) or an array of (row, col) coordinates (N x 2). Default is None.
+        - dynamic (bool): Whether to detect and correct hot/cold pixels per frame. Default is True.
+        - threshold (float): Dynamic detection threshold as a fraction of full scale. A pixel is defective
+                             when it exceeds all of its same-colour neighbours (or falls below all of them)
+                             by more than this amount.
+        - bit_depth (int): Bit depth of the RAW image (e.g., 10, 12, 14). Default is 12.
+        """
+        self.dynamic = dynamic
+        self.threshold = threshold
+        self.bit_depth = bit_depth
+
+        if defect_map is None:
+            self.defect_coords = np.zeros((0, 2), dtype=np.int64)
+        else:
+            defect_map = np.asarray(defect_map)
+            if defect_map.dtype == bool:
+                self.defect_coords = np.argwhere(defect_map)
+            elif defect_map.ndim == 2 and defect_map.shape[1] == 2:
+                self.defect_coords = defect_map.astype(np.int64)
+            else:
+                raise ValueError(f"defect_map must be a boolean mask or an (N x 2) array of (row, col) coordinates, got {defect_map.dtype} {defect_map.shape}")
+
+    def process(self, raw_data, origin=(0, 0)):
+        """
+        Process the RAW data with defective pixel correction.
+
+        Parameters:
+        - raw_data (np.ndarray): Black Level Corrected RAW image data (M x N).
+        - origin (tuple): (row, col) of raw_data inside the full RAW frame, used to place the static
+                          defect map when only a region of interest is processed. Both must be even.
+
+        Returns:
+        - dpc_data (np.ndarray): Corrected RAW image data (M x N), same dtype as the input.
+        """
+        dpc_data = raw_data.copy()
+
+        if len(self.defect_coords):
+            self._correct_static(dpc_data, origin)
+
+        if self.dynamic:
+            # Same-colour neighbours are two pixels apart, so each CFA plane is handled on its own
+            for dy in range(2):
+                for dx in range(2):
+                    plane = dpc_data[dy::2, dx::2]
+                    plane[...] = self._correct_dynamic(plane)
+
+        return dpc_data
+
+    def _correct_static(self, dpc_data, origin):
+        """
+        Replace the pixels of the static defect map with the mean of their same-colour cross neighbours,
+        leaving out neighbours that are defective themselves (e.g. couplets, defective columns). If all
+        of them are, the mean of all the neighbours is used.
+        """
+        height, width = dpc_data.shape
+        rows = self.defect_coords[:, 0] - origin[0]
+        cols = self.defect_coords[:, 1] - origin[1]
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        rows, cols = rows[inside], cols[inside]
+        if not len(rows):
+            return
+
+        defective = np.zeros((height, width), dtype=bool)
+        defective[rows, cols] = True
+
+        total = np.zeros(len(rows), dtype=np.float64)
+        count = np.zeros(len(rows), dtype=np.float64)
+        fallback_total = np.zeros(len(rows), dtype=np.float64)
+        fallback_count = np.zeros(len(rows), dtype=np.float64)
+        for dr, dc in ((-2, 0), (2, 0), (0, -2), (0, 2)):
+            r, c = rows + dr, cols + dc
+            valid = (r >= 0) & (r < height) & (c >= 0) & (c < width)
+            values = np.zeros(len(rows), dtype=np.float64)
+            values[valid] = dpc_data[r[valid], c[valid]]
+            fallback_total += values
+            fallback_count += valid
+            good = valid.copy()
+            good[valid] = ~defective[r[valid], c[valid]]
+            total += np.where(good, values, 0)
+            count += good
+
+        replacement = np.where(count > 0, total / np.maximum(count, 1), fallback_total / np.maximum(fallback_count, 1))
+        if np.issubdtype(dpc_data.dtype, np.integer):
+            replacement = np.rint(replacement)
+        dpc_data[rows, cols] = replacement.astype(dpc_data.dtype)
+
+    def _correct_dynamic(self, plane):
+        """
+        Detect hot/cold pixels against their 8 neighbours within one CFA plane and replace them
+        with the mean of the 4 cross neighbours.
+
+        Parameters:
+        - plane (np.ndarray): One CFA channel (M/2 x N/2).
+
+        Returns:
+        - plane (np.ndarray): Corrected CFA channel (M/2 x N/2).
+        """
+        threshold = self.threshold * (2 ** self.bit_depth - 1)
+        padded = np.pad(plane.astype(np.float32), 1, mode='reflect')
+        height, width = plane.shape
+        center = padded[1:-1, 1:-1]
+
+        neighbour_max = np.full(plane.shape, -np.inf, dtype=np.float32)
+        neighbour_min = np.full(plane.shape, np.inf, dtype=np.float32)
+        cross_sum = np.zeros(plane.shape, dtype=np.float32)
+        for dy in range(3):
+            for dx in range(3):
+                if dy == 1 and dx == 1:
+                    continue
+                neighbour = padded[dy:dy + height, dx:dx + width]
+                np.maximum(neighbour_max, neighbour, out=neighbour_max)
+                np.minimum(neighbour_min, neighbour, out=neighbour_min)
+                if dy == 1 or dx == 1:
+                    cross_sum += neighbour
+
+        defective = (center > neighbour_max + threshold) | (center < neighbour_min - threshold)
+        corrected = np.where(defective, cross_sum / 4, center)
+        if np.issubdtype(plane.dtype, np.integer):
+            corrected = np.rint(corrected)
+
+        return corrected.astype(plane.dtype)
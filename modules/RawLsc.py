@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Full-resolution gain maps, keyed by (calibration key, gain map source, frame shape), least recently used first
+GAIN_MAP_CACHE_SIZE = 8
+_gain_map_cache = OrderedDict()
+_gain_map_lock = threading.Lock()
+
+
+def _interpolation_matrix(size, grid_size):
+    """
+    Bilinear interpolation weights (size x grid_size) from a grid spanning the axis corner to corner.
+    """
+    matrix = np.zeros((size, grid_size), dtype=np.float32)
+    if grid_size == 1:
+        matrix[:, 0] = 1
+        return matrix
+    position = np.arange(size) * (grid_size - 1) / max(size - 1, 1)
+    lower = np.minimum(np.floor(position).astype(int), grid_size - 2)
+    weight = (position - lower).astype(np.float32)
+    matrix[np.arange(size), lower] = 1 - weight
+    matrix[np.arange(size), lower + 1] = weight
+    return matrix
+
+
+class RawLsc:
+    def __init__(self, bayer_pattern, gain_maps, key=None):
+        """
+        Initialize the RawLsc (lens shading correction) module.
+
+        Parameters:
+        - bayer_pattern (np.ndarray): Bayer Pattern layout (e.g., [[0, 1], [3, 2]] for RGGB or [[2, 3], [1, 0]] for BGGR).
+        - gain_maps (dict or str): Low-resolution gain grids for each Bayer Pattern channel, spanning the full frame,
+                                   or the path of an .npz holding them. The .npz is only read on a cache miss.
+                                   Example: {"R": r_grid, "G1": g1_grid, "G2": g2_grid, "B": b_grid}, each (gh x gw).
+        - key (tuple): Calibration key, e.g. (camera, lens, focal length, aperture). The upsampled map is
+                       cached under this key together with the identity of gain_maps; None disables caching.
+        """
+        self.bayer_pattern = bayer_pattern
+        self.gain_maps = gain_maps
+        self.key = key
+
+    def process(self, raw_data, origin=(0, 0), frame_shape=None):
+        """
+        Process the RAW data with lens shading correction.
+
+        Parameters:
+        - raw_data (np.ndarray): RAW image data (M x N).
+        - origin (tuple): (row, col) of raw_data inside the full RAW frame. Both must be even.
+        - frame_shape (tuple): Shape of the full RAW frame. Default is raw_data.shape.
+
+        Returns:
+        - lsc_data (np.ndarray): Shading corrected RAW image data (M x N), float32.
+        """
+        if frame_shape is None:
+            frame_shape = raw_data.shape
+        height, width = raw_data.shape
+        gain = self.get_gain_map(frame_shape)[origin[0]:origin[0] + height, origin[1]:origin[1] + width]
+
+        # One multiply per pixel; the gain map already interleaves the four CFA channels
+        return np.multiply(raw_data, gain, dtype=np.float32)
+
+    def get_gain_map(self, frame_shape):
+        """
+        Return the full-resolution, CFA-interleaved gain map for frame_shape, upsampling it only on a cache miss.
+        """
+        if self.key is None:
+            return self._upsample(frame_shape)
+
+        cache_key = (self.key, self._source_id(), tuple(frame_shape))
+        with _gain_map_lock:
+            if cache_key in _gain_map_cache:
+                _gain_map_cache.move_to_end(cache_key)
+                return _gain_map_cache[cache_key]
+
+        gain = self._upsample(frame_shape)
+
+        with _gain_map_lock:
+            _gain_map_cache[cache_key] = gain
+            _gain_map_cache.move_to_end(cache_key)
+            while len(_gain_map_cache) > GAIN_MAP_CACHE_SIZE:
+                _gain_map_cache.popitem(last=False)
+        return gain
+
+    def _source_id(self):
+        """
+        Identity of the gain map data: path, size and mtime for a file, a content hash for arrays.
+        """
+        if isinstance(self.gain_maps, str):
+            stat = os.stat(self.gain_maps)
+            return ("file", os.path.abspath(self.gain_maps), stat.st_size, stat.st_mtime_ns)
+        digest = hashlib.sha1()
+        for channel in sorted(self.gain_maps):
+            grid = np.ascontiguousarray(self.gain_maps[channel], dtype=np.float32)
+            digest.update(channel.encode())
+            digest.update(str(grid.shape).encode())
+            digest.update(grid.tobytes())
+        return ("data", digest.hexdigest())
+
+    def _upsample(self, frame_shape):
+        """
+        Bilinearly upsample each channel's grid to its CFA plane and interleave them into one (H x W) map.
+        """
+        if np.array_equal(self.bayer_pattern, [[0, 1], [3, 2]]):  # RGGB
+            sites = {"R": (0, 0), "G1": (0, 1), "G2": (1, 0), "B": (1, 1)}
+        elif np.array_equal(self.bayer_pattern, [[2, 3], [1, 0]]):  # BGGR
+            sites = {"B": (0, 0), "G1": (0, 1), "G2": (1, 0), "R": (1, 1)}
+        else:
+            raise ValueError("Unsupported Bayer Pattern")
+
+        gain_maps = self.gain_maps
+        if isinstance(gain_maps, str):
+            gain_maps = dict(np.load(gain_maps))
+
+        height, width = frame_shape
+        gain = np.ones((height, width), dtype=np.float32)
+        for channel, (dy, dx) in sites.items():
+            grid = np.asarray(gain_maps[channel], dtype=np.float32)
+            plane_height, plane_width = (height - dy + 1) // 2, (width - dx + 1) // 2
+            rows = _interpolation_matrix(plane_height, grid.shape[0])
+            cols = _interpolation_matrix(plane_width, grid.shape[1])
+            gain[dy::2, dx::2] = rows @ grid @ cols.T
+
+        gain.flags.writeable = False  # Shared between pipelines through the cache
+        return gain
@@ -0,0 +1,159 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Remap grids, keyed by (calibration key, model, output window), least recently used first.
+# A 24 MP grid in float16 takes ~290 MB, so only a few are kept.
+REMAP_GRID_CACHE_SIZE = 2
+_remap_grid_cache = OrderedDict()
+_remap_grid_lock = threading.Lock()
+
+
+class RgbLdc:
+    def __init__(self, distortion=None, lateral_ca=None, key=None, band_rows=128, workers=None, grid_dtype=np.float16):
+        """
+        Initialize the RgbLdc (lens distortion and lateral chromatic aberration correction) module.
+
+        Parameters:
+        - distortion (dict): Radial distortion coefficients {"k1", "k2", "k3"} of the Brown model
+                             r_src = r * (1 + k1 r^2 + k2 r^4 + k3 r^6), with r normalized by the half diagonal.
+                             Default is no distortion.
+        - lateral_ca (dict): Per-channel magnification relative to green, e.g. {"R": 1.0004, "B": 0.9997}.
+                             Default is no lateral chromatic aberration.
+        - key (tuple): Calibration key, e.g. (lens, focal length). Remap grids are cached under this key
+                       and the output window; None disables caching.
+        - band_rows (int): Height of the row bands remapped in parallel.
+        - workers (int): Number of worker threads. Default is os.cpu_count().
+        - grid_dtype (np.dtype): Storage type of the cached offsets. float16 halves the cache size and stays
+                                 within 1/16 pixel for offsets below 256 pixels.
+        """
+        self.distortion = {"k1": 0.0, "k2": 0.0, "k3": 0.0}
+        self.distortion.update(distortion or {})
+        self.lateral_ca = {"R": 1.0, "G": 1.0, "B": 1.0}
+        self.lateral_ca.update(lateral_ca or {})
+        self.key = key
+        self.band_rows = band_rows
+        self.workers = workers or os.cpu_count() or 1
+        self.grid_dtype = grid_dtype
+
+    def process(self, rgb_data, origin=(0, 0), frame_shape=None):
+        """
+        Remap each channel of the RGB image to correct distortion and lateral chromatic aberration.
+
+        Parameters:
+        - rgb_data (np.ndarray): Camera RGB image (H x W x 3).
+        - origin (tuple): (row, col) of rgb_data inside the full frame, so that a crop is corrected around
+                          the optical center of the full frame.
+        - frame_shape (tuple): (height, width) of the full frame. Default is rgb_data's own size.
+
+        Returns:
+        - ldc_data (np.ndarray): Corrected RGB image (H x W x 3), float32.
+        """
+        height, width, _ = rgb_data.shape
+        if frame_shape is None:
+            frame_shape = (height, width)
+        offsets = self.get_remap_grid((height, width), origin, frame_shape)
+        ldc_data = np.empty((height, width, 3), dtype=np.float32)
+
+        # Channels are sampled from contiguous planes; bands read any source row but write only their own rows
+        planes = [np.ascontiguousarray(rgb_data[..., c], dtype=np.float32) for c in range(3)]
+
+        def run(top):
+            bottom = min(top + self.band_rows, height)
+            for c in range(3):
+                ldc_data[top:bottom, :, c] = self._bilinear(planes[c], offsets[c], top, bottom)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(run, range(0, height, self.band_rows)))
+
+        return ldc_data
+
+    def get_remap_grid(self, shape, origin, frame_shape):
+        """
+        Return the per-channel (dy, dx) source offsets (3 x 2 x H x W), computing them only on a cache miss.
+        """
+        if self.key is None:
+            return self._compute_remap_grid(shape, origin, frame_shape)
+
+        model = (tuple(sorted(self.distortion.items())), tuple(sorted(self.lateral_ca.items())))
+        cache_key = (self.key, model, tuple(shape), tuple(origin), tuple(frame_shape), np.dtype(self.grid_dtype).str)
+        with _remap_grid_lock:
+            if cache_key in _remap_grid_cache:
+                _remap_grid_cache.move_to_end(cache_key)
+                return _remap_grid_cache[cache_key]
+
+        offsets = self._compute_remap_grid(shape, origin, frame_shape)
+
+        with _remap_grid_lock:
+            _remap_grid_cache[cache_key] = offsets
+            _remap_grid_cache.move_to_end(cache_key)
+            while len(_remap_grid_cache) > REMAP_GRID_CACHE_SIZE:
+                _remap_grid_cache.popitem(last=False)
+        return offsets
+
+    def max_offset(self, window, frame_shape):
+        """
+        Largest source offset in pixels, over all channels, of the output pixels in window
+        (top, bottom, left, right), e.g. to size the margin a crop needs around it.
+        """
+        top, bottom, left, right = window
+        center_y, center_x = (frame_shape[0] - 1) / 2, (frame_shape[1] - 1) / 2
+        norm = np.hypot(center_y, center_x)
+
+        # The offset only depends on the radius, so sample the range of radii the window spans
+        near_y = min(max(center_y, top), bottom - 1) - center_y
+        near_x = min(max(center_x, left), right - 1) - center_x
+        far_y = max(abs(top - center_y), abs(bottom - 1 - center_y))
+        far_x = max(abs(left - center_x), abs(right - 1 - center_x))
+        r = np.linspace(np.hypot(near_y, near_x), np.hypot(far_y, far_x), 4097) / norm
+        r2 = r * r
+        k1, k2, k3 = self.distortion["k1"], self.distortion["k2"], self.distortion["k3"]
+        radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+
+        return max(float(np.max(np.abs(r * (radial * self.lateral_ca[channel] - 1)))) * norm for channel in ("R", "G", "B"))
+
+    def _compute_remap_grid(self, shape, origin, frame_shape):
+        """
+        Source position of every output pixel, per channel, stored as offsets from the output position.
+        """
+        height, width = shape
+        center_y, center_x = (frame_shape[0] - 1) / 2, (frame_shape[1] - 1) / 2
+        norm = np.hypot(center_y, center_x)
+
+        y = ((np.arange(height, dtype=np.float32) + origin[0] - center_y) / norm)[:, None]
+        x = ((np.arange(width, dtype=np.float32) + origin[1] - center_x) / norm)[None, :]
+        r2 = y * y + x * x
+        k1, k2, k3 = self.distortion["k1"], self.distortion["k2"], self.distortion["k3"]
+        radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+
+        offsets = np.empty((3, 2, height, width), dtype=self.grid_dtype)
+        for c, channel in enumerate(("R", "G", "B")):
+            scale = radial * self.lateral_ca[channel] - 1
+            offsets[c, 0] = y * scale * norm
+            offsets[c, 1] = x * scale * norm
+
+        offsets.flags.writeable = False  # Shared between pipelines through the cache
+        return offsets
+
+    def _bilinear(self, plane, offsets, top, bottom):
+        """
+        Bilinearly sample rows top:bottom of the output from one source plane, clamping at the borders.
+        """
+        height, width = plane.shape
+        src_y = offsets[0, top:bottom].astype(np.float32) + np.arange(top, bottom, dtype=np.float32)[:, None]
+        src_x = offsets[1, top:bottom].astype(np.float32) + np.arange(width, dtype=np.float32)[None, :]
+        np.clip(src_y, 0, height - 1, out=src_y)
+        np.clip(src_x, 0, width - 1, out=src_x)
+
+        y0 = np.minimum(src_y.astype(np.intp), height - 2) if height > 1 else np.zeros(src_y.shape, dtype=np.intp)
+        x0 = np.minimum(src_x.astype(np.intp), width - 2) if width > 1 else np.zeros(src_x.shape, dtype=np.intp)
+        wy = src_y - y0
+        wx = src_x - x0
+        y1 = np.minimum(y0 + 1, height - 1)
+        x1 = np.minimum(x0 + 1, width - 1)
+
+        top_row = plane[y0, x0] * (1 - wx) + plane[y0, x1] * wx
+        bottom_row = plane[y1, x0] * (1 - wx) + plane[y1, x1] * wx
+        return top_row * (1 - wy) + bottom_row * wy
@@ -1,12 +1,31 @@
+import os
+import time
 import numpy as np
 from PIL import Image
 import pillow_heif
 
-# Set global options for pillow_heif
-pillow_heif.options.QUALITY = -1
+# Linear HDR values are normalized so that 1.0 is the PQ peak of 10000 cd/m2
+PQ_PEAK_LUMINANCE = 10000
+
+# HEIF/AVIF encode presets, applied per call rather than through pillow_heif.options.
+# - quality: 0-100, -1 = lossless
+# - speed: encoder speed 0 (slowest, smallest) to 9 (fastest); None = encoder default
+# - chroma: "444", "422" or "420"; None = encoder default
+# - tile_size: edge of the HEIF grid tiles in pixels, each tile an independently coded image; 0 = no grid.
+#   benchmark_hdr_presets() runs both; with x265 the grid was slower and larger, so no preset uses it.
+HDR_ENCODE_PRESETS = {
+    "lossless": {"quality": -1, "speed": None, "chroma": None, "tile_size": 0},
+    "archive": {"quality": 90, "speed": 4, "chroma": "444", "tile_size": 0},
+    "balanced": {"quality": 75, "speed": 6, "chroma": "420", "tile_size": 0},
+    "fast": {"quality": 60, "speed": 9, "chroma": "420", "tile_size": 0},
+}
+
+# x265 has named presets instead of a numeric speed
+X265_PRESETS = ["placebo", "veryslow", "slower", "slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast"]
 
 class RgbToImg:
-    def __init__(self, mode="SDR", color_space="sRGB", gamma=2.4, hdr_format="HEIF"):
+    def __init__(self, mode="SDR", color_space="sRGB", gamma=2.4, hdr_format="HEIF", tile_rows=256, mastering_display=None,
+                 encode_preset="lossless", quality=None, speed=None, chroma=None, tile_size=None, threads=None):
         """
         Initialize the RgbToImg module.
 
@@ -14,11 +33,30 @@ class RgbToImg:
         - mode (str): Output mode ("SDR" or "HDR").
         - color_space (str): Color space for HDR output ("sRGB", "Display P3", "BT-2020").
         - gamma (float): Gamma value for SDR output (default is 2.4 for sRGB).
+        - tile_rows (int): Height of the row bands the HDR transfer/quantization pass works on. None = whole frame.
+        - mastering_display (dict): {"max_luminance", "min_luminance"} in cd/m2 of the mastering display written
+                                    to HDR files, with the primaries of color_space and a D65 white.
+                                    Default is 1000 / 0.0001 cd/m2.
+        - encode_preset (str): HEIF/AVIF encode preset, a key of HDR_ENCODE_PRESETS. Default is "lossless".
+        - quality, speed, chroma, tile_size: Per-call overrides of the preset values.
+        - threads (int): Encoder worker threads. Default is os.cpu_count().
         """
         self.mode = mode
         self.color_space = color_space
         self.gamma = gamma  # Gamma value for SDR output
         self.hdr_format = hdr_format  # HDR format
+        self.tile_rows = tile_rows
+        self.mastering_display = mastering_display if mastering_display is not None else {"max_luminance": 1000, "min_luminance": 0.0001}
+        self.light_level = None  # MaxCLL / MaxFALL of the last HDR encode
+
+        if encode_preset not in HDR_ENCODE_PRESETS:
+            raise ValueError(f"Unsupported encode preset: {encode_preset}")
+        self.encode_preset = encode_preset
+        self.encode_settings = dict(HDR_ENCODE_PRESETS[encode_preset])
+        overrides = {"quality": quality, "speed": speed, "chroma": chroma, "tile_size": tile_size}
+        self.encode_settings.update({k: v for k, v in overrides.items() if v is not None})
+        self.threads = threads or os.cpu_count() or 1
+        self.encode_stats = None  # Encode time and file size of the last HDR save
 
         # Define color primaries and transfer characteristics for HDR
         self.color_primaries_map = {
@@ -33,6 +71,13 @@ class RgbToImg:
             "BT-2020": 16       # PQ
         }
 
+        # CIE xy chromaticities of the R, G, B primaries for mastering display metadata
+        self.primaries_xy_map = {
+            "sRGB": [(0.640, 0.330), (0.300, 0.600), (0.150, 0.060)],
+            "Display P3": [(0.680, 0.320), (0.265, 0.690), (0.150, 0.060)],
+            "BT-2020": [(0.708, 0.292), (0.170, 0.797), (0.131, 0.046)]
+        }
+
     def process(self, rgb_data, output_path):
         """
         Convert RGB data to an image file and save it.
@@ -40,21 +85,46 @@ class RgbToImg:
         Parameters:
         - rgb_data (np.ndarray): RGB image (H x W x 3), normalized to [0, 1].
         - output_path (str): Path where the output image will be saved.
+
+        Returns:
+        - light_level (dict): For HDR, the {"max_content_light_level", "max_pic_average_light_level"}
+                              (MaxCLL / MaxFALL, cd/m2) written to the file. None for SDR.
         """
         if self.mode == "SDR":
             self._save_sdr_image(rgb_data, output_path)
+            return None
         elif self.mode == "HDR":
             self._save_hdr_image(rgb_data, output_path)
+            return self.light_level
         else:
             raise ValueError(f"Unsupported mode: {self.mode}")
 
-    def _save_sdr_image(self, rgb_data, output_path):
+    def encode(self, rgb_data):
         """
-        Save RGB data as an 8-bit JPEG image using GOG encoding with custom gamma.
+        Apply the output transfer function and quantize without writing a file.
 
         Parameters:
         - rgb_data (np.ndarray): RGB image (H x W x 3), normalized to [0, 1].
-        - output_path (str): Path where the output image will be saved.
+
+        Returns:
+        - code_values (np.ndarray): Quantized image (H x W x 3), uint8 for SDR or uint16 for HDR.
+        """
+        if self.mode == "SDR":
+            return self._encode_sdr(rgb_data)
+        elif self.mode == "HDR":
+            return self._encode_hdr(rgb_data)
+        else:
+            raise ValueError(f"Unsupported mode: {self.mode}")
+
+    def _encode_sdr(self, rgb_data):
+        """
+        Apply GOG encoding with custom gamma and quantize to 8 bits.
+
+        Parameters:
+        - rgb_data (np.ndarray): RGB image (H x W x 3), normalized to [0, 1].
+
+        Returns:
+        - rgb_data (np.ndarray): 8-bit code values (H x W x 3).
         """
         # Apply GOG encoding (Inverse Gamma Correction)
         rgb_data = np.clip(rgb_data, 0, 1)
@@ -64,26 +134,19 @@ class RgbToImg:
         # Scale the data to 8-bit range (0-255)
         rgb_data = (rgb_data * 255).astype(np.uint8)
 
-        # Convert numpy array to PIL Image with 8-bit mode
-        img = Image.fromarray(rgb_data, mode="RGB")  # Use "RGB" for 8-bit images
+        return rgb_data
 
-        # Save as 8-bit JPEG
-        img.save(output_path, format="JPEG")
-
-    def _save_hdr_image(self, rgb_data, output_path):
+    def _encode_hdr(self, rgb_data):
         """
-        Save RGB data as an HDR HEIC/HEIF image with specified color space.
+        Apply the PQ curve and quantize to 16 bits, one row band at a time. The content light level
+        (MaxCLL / MaxFALL) is reduced from the same bands and stored in self.light_level.
 
         Parameters:
         - rgb_data (np.ndarray): RGB image (H x W x 3), normalized to [0, 1].
-        - output_path (str): Path where the output image will be saved.
-        """
-        # Get color primaries and transfer characteristics
-        color_primaries = self.color_primaries_map.get(self.color_space, 1)
-        transfer_characteristics = self.transfer_characteristics_map.get(self.color_space, 16)
 
-        # Normalize the numpy array to the range [0, 1] and then scale it to [0, 65535]
-        rgb_data = np.clip(rgb_data, 0, 1)
+        Returns:
+        - rgb_data (np.ndarray): 16-bit code values (H x W x 3).
+        """
         def pq_oetf(hdr_values):
             """
             Apply PQ OETF to convert non-linear HDR values to linear luminance.
@@ -109,8 +172,77 @@ class RgbToImg:
             linear_luminance = np.power((c1 + c2 * V_m1) / (1 + c3 * V_m1), m2)
 
             return linear_luminance
-        rgb_pq = pq_oetf(rgb_data)
-        rgb_data = (rgb_pq * 65535).astype(np.uint16)
+
+        height = rgb_data.shape[0]
+        tile_rows = self.tile_rows or height
+        code_values = np.empty(rgb_data.shape, dtype=np.uint16)
+        max_cll = 0.0
+        sum_max_rgb = 0.0
+        for top in range(0, height, tile_rows):
+            # Normalize the band to the range [0, 1] and then scale it to [0, 65535]
+            band = np.clip(rgb_data[top:top + tile_rows], 0, 1)
+
+            # Light level of a pixel is its brightest component (CTA-861.3)
+            max_rgb = band.max(axis=-1).astype(np.float64)
+            max_cll = max(max_cll, float(max_rgb.max(initial=0)))
+            sum_max_rgb += float(max_rgb.sum())
+
+            code_values[top:top + tile_rows] = (pq_oetf(band) * 65535).astype(np.uint16)
+
+        pixel_count = max(rgb_data.shape[0] * rgb_data.shape[1], 1)
+        self.light_level = {
+            "max_content_light_level": min(int(round(max_cll * PQ_PEAK_LUMINANCE)), 65535),
+            "max_pic_average_light_level": min(int(round(sum_max_rgb / pixel_count * PQ_PEAK_LUMINANCE)), 65535),
+        }
+
+        return code_values
+
+    def _mastering_display_colour_volume(self):
+        """
+        Mastering display metadata in the units of the mdcv box: chromaticities in 0.00002,
+        luminance in 0.0001 cd/m2, primaries in G, B, R order.
+        """
+        red, green, blue = self.primaries_xy_map.get(self.color_space, self.primaries_xy_map["sRGB"])
+        primaries = [green, blue, red]
+        return {
+            "display_primaries_x": [round(x / 0.00002) for x, _ in primaries],
+            "display_primaries_y": [round(y / 0.00002) for _, y in primaries],
+            "white_point_x": round(0.3127 / 0.00002),
+            "white_point_y": round(0.3290 / 0.00002),
+            "max_display_mastering_luminance": round(self.mastering_display["max_luminance"] / 0.0001),
+            "min_display_mastering_luminance": round(self.mastering_display["min_luminance"] / 0.0001),
+        }
+
+    def _save_sdr_image(self, rgb_data, output_path):
+        """
+        Save RGB data as an 8-bit JPEG image using GOG encoding with custom gamma.
+
+        Parameters:
+        - rgb_data (np.ndarray): RGB image (H x W x 3), normalized to [0, 1].
+        - output_path (str): Path where the output image will be saved.
+        """
+        rgb_data = self._encode_sdr(rgb_data)
+
+        # Convert numpy array to PIL Image with 8-bit mode
+        img = Image.fromarray(rgb_data, mode="RGB")  # Use "RGB" for 8-bit images
+
+        # Save as 8-bit JPEG
+        img.save(output_path, format="JPEG")
+
+    def _save_hdr_image(self, rgb_data, output_path):
+        """
+        Save RGB data as an HDR HEIC/HEIF image with specified color space.
+
+        Parameters:
+        - rgb_data (np.ndarray): RGB image (H x W x 3), normalized to [0, 1].
+        - output_path (str): Path where the output image will be saved.
+        """
+        # Get color primaries and transfer characteristics
+        color_primaries = self.color_primaries_map.get(self.color_space, 1)
+        transfer_characteristics = self.transfer_characteristics_map.get(self.color_space, 16)
+
+        rgb_data = self._encode_hdr(rgb_data)
+
         # Create a HEIF image from the numpy array
         img = pillow_heif.from_bytes(
             mode="RGB;16",
@@ -123,8 +255,88 @@ class RgbToImg:
             'format': self.hdr_format,
             'color_primaries': color_primaries,
             'transfer_characteristics': transfer_characteristics,
+            'content_light_level': self.light_level,
+            'mastering_display_colour_volume': self._mastering_display_colour_volume(),
         }
+        kwargs.update(self._encoder_kwargs())
 
         # Save the image to the specified output path
+        start = time.perf_counter()
         img.save(output_path, **kwargs)
+        self.encode_stats = {
+            "preset": self.encode_preset,
+            "tile_size": self.encode_settings["tile_size"],
+            "seconds": time.perf_counter() - start,
+            "bytes": os.path.getsize(output_path),
+        }
+
+    def _encoder_kwargs(self):
+        """
+        Translate the encode settings into pillow_heif save arguments for the selected format.
+        """
+        settings = self.encode_settings
+        enc_params = {}
+        if self.hdr_format == "AVIF":
+            # aom / svt-av1 / rav1e all take a numeric speed and a thread count
+            if settings["speed"] is not None:
+                enc_params["speed"] = settings["speed"]
+            enc_params["threads"] = self.threads
+        else:
+            if settings["speed"] is not None:
+                enc_params["preset"] = X265_PRESETS[min(max(settings["speed"], 0), 9)]
+            enc_params["x265:pools"] = self.threads
+
+        kwargs = {
+            'quality': settings["quality"],
+            'tile_size': settings["tile_size"],
+            'enc_params': enc_params,
+        }
+        if settings["chroma"] is not None:
+            kwargs['chroma'] = settings["chroma"]
+        return kwargs
+
+
+def benchmark_hdr_presets(rgb_data, output_dir, presets=None, tile_sizes=(0, 512), **kwargs):
+    """
+    Encode the same HDR frame with each preset and tile size and report encode time and file size.
+
+    Parameters:
+    - rgb_data (np.ndarray): RGB image (H x W x 3), normalized to [0, 1].
+    - output_dir (str): Directory for the encoded files.
+    - presets (list): Preset names to run. Default is all of HDR_ENCODE_PRESETS.
+    - tile_sizes (list): Grid tile sizes to run every preset with, 0 = no grid. None = only the preset's own.
+    - kwargs: Other RgbToImg arguments (color_space, hdr_format, threads, ...).
+
+    Returns:
+    - results (list): One encode_stats dict per preset and tile size.
+    """
+    results = []
+    extension = "avif" if kwargs.get("hdr_format") == "AVIF" else "heic"
+    for preset in presets or HDR_ENCODE_PRESETS:
+        for tile_size in tile_sizes or [None]:
+            rgb_to_img = RgbToImg(mode="HDR", encode_preset=preset, tile_size=tile_size, **kwargs)
+            output_path = os.path.join(output_dir, f"preset_{preset}_{rgb_to_img.encode_settings['tile_size']}.{extension}")
+            rgb_to_img.process(rgb_data, output_path)
+            results.append(rgb_to_img.encode_stats)
+    return results
+
+
+def main():
+    """
+    Benchmark the HDR encode presets, with and without a tile grid, on a synthetic 24 MP frame.
+    """
+    import tempfile
+    height, width = 4000, 6000
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    rgb_data = np.stack([x / width, y / height, 1 - x / width], axis=-1) * 0.1
+    # Add texture so the lossy presets have detail to code, as in a real photograph
+    rgb_data *= 1 + 0.05 * np.random.default_rng(0).standard_normal((height, width, 1), dtype=np.float32)
+
+    print(f"{'preset':<10} {'tile':>5} {'seconds':>8} {'MB':>8}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for stats in benchmark_hdr_presets(rgb_data, output_dir, color_space="Display P3", hdr_format="HEIF"):
+            print(f"{stats['preset']:<10} {stats['tile_size']:>5} {stats['seconds']:>8.2f} {stats['bytes'] / 1e6:>8.2f}")
+
+if __name__ == "__main__":
+    main()
 
@@ -1,7 +1,8 @@
 import numpy as np
+from modules.polonomial import generate_rho
 
 class RgbToXyz:
-    def __init__(self, method="greyworld", ccm=None, polynomial_coeffs=None, bit_depth=None, expo_factor=None):
+    def __init__(self, method="greyworld", ccm=None, polynomial_coeffs=None, bit_depth=None, expo_factor=None, wb_means=None, polynomial_order=9):
         """
         Initialize the RgbToXyz module.
 
@@ -9,12 +10,17 @@ class RgbToXyz:
         - method (str): Method to use for conversion ("greyworld" or "polynomial").
         - ccm (np.ndarray): Color Correction Matrix (3x3) for CCM-based conversion.
         - polynomial_coeffs (np.ndarray): Polynomial coefficients for polynomial-based conversion.
+        - wb_means (np.ndarray): Optional per-channel (R, G, B) means for greyworld, e.g. gathered over the
+                                 full frame when only a crop is processed. Default is the image's own means.
+        - polynomial_order (int): Number of polynomial terms of polynomial_coeffs (3, 5, 9, 11, 18 or 20). Default is 9.
         """
         self.method = method
         self.ccm = ccm  # Color Correction Matrix (3x3)
         self.polynomial_coeffs = polynomial_coeffs  # Polynomial coefficients (1xN)
         self.bit_depth = bit_depth
         self.expo_factor = expo_factor
+        self.wb_means = wb_means
+        self.polynomial_order = polynomial_order
 
     def process(self, rgb_data):
         """
@@ -62,9 +68,12 @@ class RgbToXyz:
         - rgb_balanced (np.ndarray): White-balanced RGB image (H x W x 3).
         """
         # Calculate the mean values for each channel
-        mean_r = np.mean(rgb_data[..., 0])
-        mean_g = np.mean(rgb_data[..., 1])
-        mean_b = np.mean(rgb_data[..., 2])
+        if self.wb_means is not None:
+            mean_r, mean_g, mean_b = self.wb_means
+        else:
+            mean_r = np.mean(rgb_data[..., 0])
+            mean_g = np.mean(rgb_data[..., 1])
+            mean_b = np.mean(rgb_data[..., 2])
 
         # Calculate scaling factors for white balance
         scale_r = mean_g / mean_r
@@ -94,13 +103,8 @@ class RgbToXyz:
         height, width, _ = rgb_data.shape
         rgb_flat = rgb_data.reshape(-1, 3)  # Flatten to (N x 3)
         rgb_flat = rgb_flat * (2**self.bit_depth - 1)  # Scale to [0, 2^bit_depth - 1]
-        # Polynomial expansion
-        rgb_expanded = np.zeros((rgb_flat.shape[0], rgb_flat.shape[1] + 6))  # Expand to (N x 9)
-        rgb_expanded[:, :3] = rgb_flat  # Copy original RGB values
-        rgb_expanded[:, 3] = rgb_flat[:, 0] * rgb_flat[:, 1]  # R * G
-        rgb_expanded[:, 4] = rgb_flat[:, 0] * rgb_flat[:, 2]  # R * B
-        rgb_expanded[:, 5] = rgb_flat[:, 1] * rgb_flat[:, 2]  # G * B
-        rgb_expanded[:, 6:] = rgb_flat**2  # R^2, G^2, B^2
+        # Polynomial expansion, e.g. R, G, B, RG, RB, GB, R^2, G^2, B^2 for 9 terms
+        rgb_expanded = generate_rho(rgb_flat, self.polynomial_order)  # Expand to (N x polynomial_order)
 
         # Apply polynomial transformation using the coefficients
         xyz_flat = np.dot(rgb_expanded, self.polynomial_coeffs.T) * self.expo_factor / 10000  # (N x 3) for PQ curve for divisible by 10000
@@ -3,24 +3,37 @@ import numpy as np
 import exifread
 import math
 from modules.RawBlc import RawBlc
+from modules.RawDpc import RawDpc
+from modules.RawLsc import RawLsc
+from modules.RawDenoise import RawDenoise, MODE_RADIUS
+from modules.RgbLdc import RgbLdc
 from modules.RawToRgb import RawToRgb
 from modules.RgbToXyz import RgbToXyz
 from modules.XyzToRgb import XyzToRgb
 from modules.RgbToImg import RgbToImg
+from modules.CameraProfile import get_camera_profile
 
 class ImagePipeline:
     def __init__(self, params):
         self.params = params
         self.raw_data = None
         self.blc_data = None
+        self.lens_key = None
+        self.iso = None
+        self.camera_profile = None
         self.rgb_data = None
         self.xyz_data = None
         self.rgb_data_final = None
+        self.light_level = None
+        self.steps = []
+        self.roi_window = None
+        self.wb_means = None
         self.exposure_factor = self.read_exif()
 
     def read_raw_data(self):
         raw = rawpy.imread(self.params["raw_file_path"])
         self.raw_data = raw.raw_image
+        self.raw_shape = self.raw_data.shape
         self.bayer_pattern = raw.raw_pattern
         self.bit_depth = math.log(raw.white_level + 1, 2)
         self.blc_params = {
@@ -30,25 +43,190 @@ class ImagePipeline:
             "B": raw.black_level_per_channel[3]
         }
 
+        if self.params.get("roi") is not None:
+            if self.params.get("rgb_to_xyz_method") == "greyworld" and self.params.get("greyworld_stats", "roi") == "full":
+                self.wb_means = self.full_frame_greyworld_means(self.raw_data)
+            self.roi_window = self.compute_roi_window(self.raw_data.shape)
+            top, bottom, left, right = self.roi_window["window"]
+            # Basic slicing keeps this a view; only the window is copied later by RawBlc
+            self.raw_data = self.raw_data[top:bottom, left:right]
+
+    def compute_roi_window(self, raw_shape):
+        """
+        Snap the requested ROI to the CFA 2x2 grid and add a margin for demosaicing.
+
+        params["roi"] is (x, y, width, height) in RAW pixel coordinates, params["roi_margin"]
+        the demosaic margin in pixels (default 2, rounded up to a multiple of 2). The footprints of the
+        Bayer-domain neighbourhood stages and the largest lens geometry offset over the ROI are added
+        on top, so that the ROI matches a full-frame run.
+
+        Returns:
+        - roi_window (dict): "window" (top, bottom, left, right) to cut from the RAW frame and
+                             "crop" (top, bottom, left, right) of the ROI inside that window.
+        """
+        x, y, width, height = self.params["roi"]
+        frame_height, frame_width = raw_shape[0] - raw_shape[0] % 2, raw_shape[1] - raw_shape[1] % 2
+        margin = self.params.get("roi_margin", 2)
+        margin += margin % 2
+        if "apply_dpc" in self.steps:
+            margin += 2  # 3x3 neighbourhood on the CFA planes
+        if "apply_denoise" in self.steps:
+            margin += 2 * MODE_RADIUS[self.params.get("denoise_mode", "quality")]
+
+        # Even offsets keep the window on the same CFA phase as the full frame
+        left = min(max(x // 2 * 2, 0), frame_width)
+        top = min(max(y // 2 * 2, 0), frame_height)
+        right = min(-(-(x + width) // 2) * 2, frame_width)
+        bottom = min(-(-(y + height) // 2) * 2, frame_height)
+        if right <= left or bottom <= top:
+            raise ValueError(f"ROI {self.params['roi']} does not overlap the {raw_shape[1]}x{raw_shape[0]} frame")
+
+        if self.lens_geometry_active():
+            # The remap reads up to the largest offset away from the ROI, so the window must hold those
+            # source pixels too; the margin is then cropped after correct_lens_geometry instead of before it
+            scale = 1 if self.params["demosaic"] else 2
+            rgb_ldc = RgbLdc(distortion=self.params.get("lens_distortion"), lateral_ca=self.params.get("lateral_ca"))
+            offset = rgb_ldc.max_offset((top // scale, bottom // scale, left // scale, right // scale), (raw_shape[0] // scale, raw_shape[1] // scale))
+            lens_margin = (math.ceil(offset) + 1) * scale  # +1 for the second bilinear tap
+            margin += lens_margin + lens_margin % 2
+
+        win_left, win_top = max(left - margin, 0), max(top - margin, 0)
+        win_right, win_bottom = min(right + margin, frame_width), min(bottom + margin, frame_height)
+
+        return {
+            "window": (win_top, win_bottom, win_left, win_right),
+            "crop": (top - win_top, bottom - win_top, left - win_left, right - win_left),
+        }
+
+    def full_frame_greyworld_means(self, raw_data):
+        """
+        Per-channel (R, G, B) greyworld statistics of the full black-level-corrected frame, read
+        straight from the Bayer planes so that an ROI run can be balanced like a full-frame run.
+        Shading correction is applied with the cached full-resolution gain map when apply_lsc is run;
+        the neighbourhood stages (DPC, denoise) are left out, as they barely move the channel means.
+        """
+        max_value = 2 ** self.bit_depth - 1
+        gain = None
+        if "apply_lsc" in self.steps and self.params.get("lsc_gain_maps") is not None:
+            gain = RawLsc(self.bayer_pattern, self.params["lsc_gain_maps"], key=self.lens_key).get_gain_map(self.raw_shape)
+        site_names = {(0, 1): "G1", (1, 0): "G2"}
+        sums = np.zeros(3)
+        counts = np.zeros(3)
+        for dy in range(2):
+            for dx in range(2):
+                color = int(self.bayer_pattern[dy][dx])
+                channel = {0: 0, 2: 2}.get(color, 1)
+                name = {0: "R", 2: "B"}.get(color, site_names.get((dy, dx)))
+                plane = np.maximum(raw_data[dy::2, dx::2].astype(np.float32) - self.blc_params[name], 0)
+                if gain is not None:
+                    plane *= gain[dy::2, dx::2]
+                sums[channel] += np.mean(plane) / max_value
+                counts[channel] += 1
+        return sums / counts
+
     def read_exif(self):
         tags = exifread.process_file(open(self.params["raw_file_path"], 'rb'))
         shutter_speed = tags['EXIF ExposureTime'].values[0]
         aperture = tags['EXIF FNumber'].values[0]
         ISO = tags['EXIF ISOSpeedRatings'].values[0]
-        CCM_aperture, CCM_SS, CCM_ISO = 8, 1/4, 100
-        expo_factor = (CCM_SS / shutter_speed) * (aperture / CCM_aperture)**2 * (CCM_ISO / ISO)
-        return expo_factor
+        self.iso = ISO
+        # Calibration key for lens-dependent corrections: (camera, lens, focal length, aperture)
+        self.lens_key = (
+            f"{tags.get('Image Make', '')} {tags.get('Image Model', '')}".strip(),
+            str(tags.get('EXIF LensModel', '')),
+            str(tags.get('EXIF FocalLength', '')),
+            str(aperture),
+        )
+        # Calibration reference exposure comes from the profile of the camera body
+        self.camera_profile = get_camera_profile(tags.get('Image Make', ''), tags.get('Image Model', ''), self.params.get("camera_profiles"))
+        if self.camera_profile is None:
+            if self.params.get("rgb_to_xyz_method") == "polynomial" and self.params.get("polynomial_coeffs") is None:
+                raise ValueError(f"No camera profile for {tags.get('Image Make', '')} {tags.get('Image Model', '')}")
+            CCM_aperture, CCM_SS, CCM_ISO = 8, 1/4, 100
+            expo_factor = (CCM_SS / shutter_speed) * (aperture / CCM_aperture)**2 * (CCM_ISO / ISO)
+            return expo_factor
+        return self.camera_profile.exposure_factor(float(shutter_speed), float(aperture), float(ISO))
 
     def apply_blc(self):
         raw_blc = RawBlc(self.bayer_pattern, self.blc_params)
         self.blc_data = raw_blc.process(self.raw_data)
 
+    def raw_origin(self):
+        """
+        (row, col) of self.raw_data inside the full RAW frame.
+        """
+        if self.roi_window is None:
+            return (0, 0)
+        top, _, left, _ = self.roi_window["window"]
+        return (top, left)
+
+    def apply_dpc(self):
+        raw_dpc = RawDpc(defect_map=self.params.get("defect_map"), dynamic=self.params.get("dpc_dynamic", False), threshold=self.params.get("dpc_threshold", 0.05), bit_depth=self.bit_depth)
+        self.blc_data = raw_dpc.process(self.blc_data, origin=self.raw_origin())
+
+    def apply_lsc(self):
+        gain_maps = self.params.get("lsc_gain_maps")
+        if gain_maps is None:
+            return
+        raw_lsc = RawLsc(self.bayer_pattern, gain_maps, key=self.lens_key)
+        self.blc_data = raw_lsc.process(self.blc_data, origin=self.raw_origin(), frame_shape=self.raw_shape)
+
+    def apply_denoise(self):
+        raw_denoise = RawDenoise(iso=self.iso, noise_profile=self.params.get("noise_profile"), strength=self.params.get("denoise_strength", 1.0), mode=self.params.get("denoise_mode", "quality"), workers=self.params.get("workers"), time_budget=self.params.get("denoise_time_budget"))
+        self.blc_data = raw_denoise.process(self.blc_data)
+        if raw_denoise.budget_met is False:
+            print(f"Denoise over budget: {raw_denoise.applied_mode} estimated at {raw_denoise.estimated_cost:.0f} ms/MP")
+
     def convert_raw_to_rgb(self):
         raw_to_rgb = RawToRgb(self.blc_data, self.bayer_pattern, demosaic=self.params["demosaic"], bit_depth=self.bit_depth)
         self.rgb_data = raw_to_rgb.process()
 
+        if self.roi_window is not None and not self.lens_geometry_active():
+            self.crop_roi_margin()
+
+    def crop_roi_margin(self):
+        """
+        Drop the margin around the ROI from self.rgb_data; without demosaicing every output pixel covers a 2x2 quad.
+        """
+        top, bottom, left, right = self.roi_window["crop"]
+        scale = 1 if self.params["demosaic"] else 2
+        self.rgb_data = self.rgb_data[top // scale:bottom // scale, left // scale:right // scale]
+
+    def lens_geometry_active(self):
+        """
+        Whether correct_lens_geometry is run and has a distortion or lateral CA model to apply.
+        """
+        return "correct_lens_geometry" in self.steps and (self.params.get("lens_distortion") is not None or self.params.get("lateral_ca") is not None)
+
+    def correct_lens_geometry(self):
+        distortion = self.params.get("lens_distortion")
+        lateral_ca = self.params.get("lateral_ca")
+        if distortion is None and lateral_ca is None:
+            return
+
+        # Correct around the optical center of the full frame, also when only an ROI is processed.
+        # The whole ROI window is remapped, so the ROI samples real pixels rather than clamping at its edge.
+        scale = 1 if self.params["demosaic"] else 2
+        origin = (0, 0)
+        if self.roi_window is not None:
+            win_top, _, win_left, _ = self.roi_window["window"]
+            origin = (win_top // scale, win_left // scale)
+        frame_shape = (self.raw_shape[0] // scale, self.raw_shape[1] // scale)
+
+        key = self.lens_key[1:3] if self.lens_key is not None else None  # (lens, focal length)
+        rgb_ldc = RgbLdc(distortion=distortion, lateral_ca=lateral_ca, key=key, workers=self.params.get("workers"))
+        self.rgb_data = rgb_ldc.process(self.rgb_data, origin=origin, frame_shape=frame_shape)
+
+        if self.roi_window is not None:
+            self.crop_roi_margin()
+
     def convert_rgb_to_xyz(self):
-        rgb_to_xyz = RgbToXyz(method=self.params["rgb_to_xyz_method"], ccm=self.params["ccm"], polynomial_coeffs=self.params["polynomial_coeffs"], bit_depth=self.bit_depth, expo_factor=self.exposure_factor)
+        polynomial_coeffs = self.params.get("polynomial_coeffs")
+        polynomial_order = self.params.get("polynomial_order", 9)
+        if polynomial_coeffs is None and self.camera_profile is not None:
+            polynomial_coeffs = self.camera_profile.polynomial_coeffs.T
+            polynomial_order = self.camera_profile.polynomial_order
+        rgb_to_xyz = RgbToXyz(method=self.params["rgb_to_xyz_method"], ccm=self.params["ccm"], polynomial_coeffs=polynomial_coeffs, bit_depth=self.bit_depth, expo_factor=self.exposure_factor, wb_means=self.wb_means, polynomial_order=polynomial_order)
         self.xyz_data = rgb_to_xyz.process(self.rgb_data)
 
     def convert_xyz_to_rgb(self):
@@ -56,15 +234,20 @@ class ImagePipeline:
         self.rgb_data_final = xyz_to_rgb.process(self.xyz_data)
 
     def save_image(self):
-        rgb_to_img = RgbToImg(mode=self.params["output_mode"], gamma=self.params["gamma"], color_space=self.params["color_space"], hdr_format= self.params["hdr_format"])
-        rgb_to_img.process(self.rgb_data_final, self.params["output_path"])
+        rgb_to_img = RgbToImg(mode=self.params["output_mode"], gamma=self.params["gamma"], color_space=self.params["color_space"], hdr_format= self.params["hdr_format"], encode_preset=self.params.get("encode_preset", "lossless"), threads=self.params.get("workers"))
+        self.light_level = rgb_to_img.process(self.rgb_data_final, self.params["output_path"])
         print(f"Image saved to {self.params['output_path']}")
+        if self.light_level is not None:
+            print(f"MaxCLL: {self.light_level['max_content_light_level']} cd/m2, MaxFALL: {self.light_level['max_pic_average_light_level']} cd/m2")
+        if rgb_to_img.encode_stats is not None:
+            print(f"Encoded with preset {rgb_to_img.encode_stats['preset']} in {rgb_to_img.encode_stats['seconds']:.2f} s, {rgb_to_img.encode_stats['bytes']} bytes")
 
     def run(self, steps):
         """
         根据传入的步骤列表运行流水线
         :param steps: 步骤名称的列表，例如 ["read_raw_data", "apply_blc", "convert_raw_to_rgb"]
         """
+        self.steps = list(steps)
         for step in steps:
             if hasattr(self, step):
                 getattr(self, step)()  # 动态调用方法
@@ -81,6 +264,9 @@ def main():
         "output_mode": "HDR",
         "image_name": "output_img",
         "hdr_format": "AVIF",
+        "lens_distortion": None,  # {"k1", "k2", "k3"} radial distortion, None = no correction
+        "lateral_ca": None,  # Magnification of "R" and "B" relative to green, None = no correction
+        "encode_preset": "lossless",  # "lossless", "archive", "balanced" or "fast"
         "output_path": "DSC04665.avif",
         "ccm": np.array([
             [0.4124, 0.3576, 0.1805],
@@ -89,7 +275,20 @@ def main():
         ]),
         "gamma": 2.2,
         "demosaic": False,
-        "polynomial_coeffs": np.load('ILCE7CM2_Ver2_D65.npy').T,
+        "polynomial_coeffs": None,  # None = coefficients of the camera profile
+        "camera_profiles": None,  # Registry of per-body calibration profiles; None = camera_profiles.json of the repository
+        "roi": None,  # (x, y, width, height) in RAW pixels, None = full frame
+        "roi_margin": 2,  # Extra RAW pixels around the ROI for demosaicing
+        "greyworld_stats": "roi",  # "roi" or "full": where greyworld statistics are gathered
+        "defect_map": None,  # Static defects: boolean mask or (row, col) list in RAW pixels; add "apply_dpc" to steps to use
+        "dpc_dynamic": False,  # Detect hot/cold pixels per frame in "apply_dpc"
+        "dpc_threshold": 0.05,  # Fraction of full scale above/below all same-colour neighbours
+        "lsc_gain_maps": None,  # .npz with low-resolution "R", "G1", "G2", "B" gain grids
+        "noise_profile": None,  # {"shot", "read", "base_iso"}, None = RawDenoise default; add "apply_denoise" to steps to use
+        "denoise_strength": 1.0,
+        "denoise_mode": "quality",  # "quality", "fast" or "minimal"
+        "denoise_time_budget": None,  # ms per megapixel; picks the most expensive mode that fits
+        "workers": None,  # Worker threads, None = all cores
     }
 
     # Create an instance of the ImagePipeline class
@@ -99,7 +298,9 @@ def main():
     steps = [
         "read_raw_data",
         "apply_blc",
+        "apply_lsc",
         "convert_raw_to_rgb",
+        "correct_lens_geometry",
         "convert_rgb_to_xyz",
         "convert_xyz_to_rgb",
         "save_image"